@@ -1,18 +1,26 @@
 #!/usr/bin/env python
 
 
-from PyQt5.QtCore import QDir, Qt, QThread, pyqtSlot
+from PyQt5.QtCore import QDir, QMetaObject, QStandardPaths, Qt, QThread, pyqtSlot
 from PyQt5.QtGui import QImage, QPainter, QPalette, QPixmap
 from PyQt5.QtWidgets import (QAction, QApplication, QFileDialog, QLabel,
                              QMainWindow, QMenu, QMessageBox, QScrollArea, QSizePolicy, QVBoxLayout, QWidget)
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 
+import os
 from functools import partial
 
 import effects
+import pipeline
+import registry
+import server
+from cache import SEQUENCE_CACHE_SIZE, ResultCache
 from components import SliderTabsWidget
 
 
+SEQUENCE_FPS = 25
+
+
 class ImageViewer(QMainWindow):
 
     def __init__(self):
@@ -44,7 +52,14 @@ class ImageViewer(QMainWindow):
         self.back_thread = QThread()
         self.back_thread.start()
 
+        cache_location = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+        self.cache = ResultCache(os.path.join(cache_location, 'effects'))
+        self.sequence_cache = ResultCache(os.path.join(cache_location, 'sequences'), max_size=SEQUENCE_CACHE_SIZE)
+        # local effect server is used when it is running
+        self.client = server.connect()
+
         self.origin_pixmap = QPixmap()
+        self.chain = []
         self.printer = QPrinter()
         self.scaleFactor = 0.0
 
@@ -82,19 +97,32 @@ class ImageViewer(QMainWindow):
     def effect(self, effect):
 
         self.updateActions(state=False)
+        self.chain.append((effect, {}))
 
         progressbar = self.SlidersWidget.progressbar
         image = self.imageLabel.pixmap().toImage()
 
-        self.thread = effects.Threader(image, effect, progressbar=progressbar)
+        self.thread = effects.Threader(image, effect, progressbar=progressbar, cache=self.cache, client=self.client)
         self.thread.moveToThread(self.back_thread)
 
         self.thread.sig_done.connect(progressbar.done)
         self.thread.sig_done.connect(self.effected)
         self.thread.sig_step.connect(progressbar.set_value)
+        self.thread.sig_client_lost.connect(self.client_lost)
+
+        # one-shot start, connecting to back_thread.started would replay every earlier job
+        QMetaObject.invokeMethod(self.thread, 'run', Qt.QueuedConnection)
 
-        self.back_thread.started.connect(self.thread.run)
-        self.back_thread.started.emit()
+    @pyqtSlot()
+    def client_lost(self):
+        self.client = None
+
+    def closeEvent(self, event):
+        # shared memory of the client is released here, not by the resource tracker at exit
+        if self.client:
+            self.client.close()
+            self.client = None
+        super(ImageViewer, self).closeEvent(event)
 
     @pyqtSlot(QImage)
     def effected(self, image):
@@ -114,6 +142,7 @@ class ImageViewer(QMainWindow):
             self.origin_pixmap = QPixmap.fromImage(image)
             self.imageLabel.setPixmap(self.origin_pixmap)
             self.scaleFactor = 1.0
+            self.chain = []
 
             self.fitToWindow_act.setEnabled(True)
             self.updateActions()
@@ -135,6 +164,7 @@ class ImageViewer(QMainWindow):
 
     def reset_effects(self):
         self.imageLabel.setPixmap(self.origin_pixmap)
+        self.chain = []
         self.reset_sliders()
 
     def reset_sliders(self):
@@ -148,6 +178,66 @@ class ImageViewer(QMainWindow):
             if not image.save(fileName):
                 QMessageBox.information(self, "Image Voover", "Cannot save %s." % fileName)
 
+    def sequence(self):
+
+        folder = QFileDialog.getExistingDirectory(self, "Open Sequence", QDir.currentPath())
+        if not folder:
+            return
+
+        frames = pipeline.read_sequence(folder)
+        if not frames:
+            QMessageBox.information(self, "Image Voover", "No numbered frames in %s." % folder)
+            return
+
+        # without output folder the sequence is only played
+        output = QFileDialog.getExistingDirectory(self, "Save Sequence (cancel to preview)", QDir.currentPath())
+
+        # frames are written under their own names, they would replace the source
+        if output and os.path.samefile(output, folder):
+            QMessageBox.information(self, "Image Voover", "Cannot save sequence to its own folder %s." % folder)
+            return
+
+        self.updateActions(state=False)
+
+        progressbar = self.SlidersWidget.progressbar
+        progressbar.setRange(0, len(frames) - 1)
+        progressbar.setFormat('Sequence: %p%')
+
+        # preview is not cached, rendered frames have their own cache to keep viewer results
+        fps = None if output else SEQUENCE_FPS
+        cache = self.sequence_cache if output else None
+        self.frame_pipeline = pipeline.FramePipeline(frames, self.chain, output=output or None, fps=fps, cache=cache)
+        self.frame_pipeline.moveToThread(self.back_thread)
+
+        self.frame_pipeline.sig_frame.connect(self.show_frame)
+        self.frame_pipeline.sig_step.connect(progressbar.set_value)
+        self.frame_pipeline.sig_error.connect(self.sequence_error)
+        self.frame_pipeline.sig_done.connect(self.sequence_done)
+
+        self.sequence_errors = []
+
+        QMetaObject.invokeMethod(self.frame_pipeline, 'run', Qt.QueuedConnection)
+
+    @pyqtSlot(str)
+    def sequence_error(self, message):
+        print(message)
+        self.sequence_errors.append(message)
+
+    @pyqtSlot()
+    def sequence_done(self):
+        self.frame_pipeline = None
+        self.updateActions()
+
+        if self.sequence_errors:
+            QMessageBox.information(self, "Image Voover", "Sequence finished with %s errors, first: %s"
+                                    % (len(self.sequence_errors), self.sequence_errors[0]))
+
+    @pyqtSlot(QImage)
+    def show_frame(self, image):
+        self.imageLabel.setPixmap(QPixmap.fromImage(image))
+        if not self.fitToWindow_act.isChecked():
+            self.imageLabel.adjustSize()
+
     def zoomIn(self):
         self.scaleImage(1.25)
 
@@ -179,6 +269,7 @@ class ImageViewer(QMainWindow):
         self.open_act = QAction("&Open...", self, shortcut="Ctrl+O", triggered=self.open)
         self.print_act = QAction("&Print...", self, shortcut="Ctrl+P", enabled=False, triggered=self.print_)
         self.save_act = QAction("&Save...", self, shortcut="Ctrl+S", enabled=False, triggered=self.save)
+        self.sequence_act = QAction("Se&quence...", self, triggered=self.sequence)
         self.exit_act = QAction("E&xit", self, shortcut="Ctrl+Q", triggered=self.close)
 
         # === VIEW ===
@@ -192,14 +283,10 @@ class ImageViewer(QMainWindow):
 
         self.remove_filters_act = QAction("Remove filters", self, shortcut="Ctrl+Backspace", enabled=False, triggered=self.reset_effects)
 
-        self.greys_act = QAction("Greys", self, enabled=False, triggered=partial(self.effect, effects.grey))
-        self.colorize_act = QAction("Colorize", self, enabled=False, triggered=partial(self.effect, effects.floodfill))
-
-        self.sepia_act = QAction("Sepia", self, enabled=False, triggered=partial(self.effect, effects.sepia))
-        self.invert_act = QAction("Invert", self, enabled=False, triggered=partial(self.effect, effects.invert))
-        self.black_white_act = QAction("Black & White", self, enabled=False, triggered=partial(self.effect, effects.black_white))
-        self.noise_act = QAction("Noise", self, enabled=False, triggered=partial(self.effect, effects.noise))
-        self.blue_yellow_act = QAction("Blue & Yellow", self, enabled=False, triggered=partial(self.effect, effects.blue_yellow))
+        self.effect_acts = [
+            (effect, QAction(effect.menu, self, enabled=False, triggered=partial(self.effect, effect.function)))
+            for effect in registry.menu()
+        ]
 
         # === ABOUT ===
 
@@ -212,6 +299,7 @@ class ImageViewer(QMainWindow):
         self.fileMenu.addAction(self.open_act)
         self.fileMenu.addAction(self.print_act)
         self.fileMenu.addAction(self.save_act)
+        self.fileMenu.addAction(self.sequence_act)
         self.fileMenu.addSeparator()
         self.fileMenu.addAction(self.exit_act)
 
@@ -224,15 +312,13 @@ class ImageViewer(QMainWindow):
 
         self.filterMenu = QMenu("&Filters", self)
         self.filterMenu.addAction(self.remove_filters_act)
-        self.filterMenu.addSeparator()
-        self.filterMenu.addAction(self.greys_act)
-        self.filterMenu.addAction(self.colorize_act)
-        self.filterMenu.addSeparator()
-        self.filterMenu.addAction(self.sepia_act)
-        self.filterMenu.addAction(self.invert_act)
-        self.filterMenu.addAction(self.black_white_act)
-        self.filterMenu.addAction(self.noise_act)
-        self.filterMenu.addAction(self.blue_yellow_act)
+
+        group = None
+        for effect, action in self.effect_acts:
+            if effect.group != group:
+                self.filterMenu.addSeparator()
+                group = effect.group
+            self.filterMenu.addAction(action)
 
         self.helpMenu = QMenu("&Help", self)
         self.helpMenu.addAction(self.about_act)
@@ -248,6 +334,7 @@ class ImageViewer(QMainWindow):
         self.open_act.setEnabled(state)
         self.print_act.setEnabled(state)
         self.save_act.setEnabled(state)
+        self.sequence_act.setEnabled(state)
 
         self.zoomIn_act.setEnabled(not self.fitToWindow_act.isChecked() if state else False)
         self.zoomOut_act.setEnabled(not self.fitToWindow_act.isChecked() if state else False)
@@ -255,13 +342,8 @@ class ImageViewer(QMainWindow):
         self.fitToWindow_act.setEnabled(state)
 
         self.remove_filters_act.setEnabled(state)
-        self.greys_act.setEnabled(state)
-        self.colorize_act.setEnabled(state)
-        self.sepia_act.setEnabled(state)
-        self.invert_act.setEnabled(state)
-        self.black_white_act.setEnabled(state)
-        self.noise_act.setEnabled(state)
-        self.blue_yellow_act.setEnabled(state)
+        for effect, action in self.effect_acts:
+            action.setEnabled(state)
 
         self.about_act.setEnabled(state)
         self.aboutQt_act.setEnabled(state)
@@ -291,4 +373,4 @@ if __name__ == '__main__':
     imageViewer.resize(800, 600)
     imageViewer.show()
 
-sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,136 @@
+from PyQt5.QtGui import QImage
+
+import hashlib
+import os
+import sys
+from functools import lru_cache
+
+import colorspace
+import effects
+import labeling
+
+
+CACHE_SIZE = 512 * 1024 * 1024
+SEQUENCE_CACHE_SIZE = 1024 * 1024 * 1024
+
+# eviction frees a bit more than needed, so it does not run on every put
+EVICT_RATIO = 0.9
+
+# png with fast compression: lossless and cheap to write
+CACHE_FORMAT = 'PNG'
+CACHE_QUALITY = 80
+
+# modules which make results of every chain: fused paths, labeling and color tables
+ENGINE_MODULES = (effects, labeling, colorspace)
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path):
+    # digest of the file when it is first used, it matches the code which is running
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def source_version(chain):
+
+    # editing any module the chain runs through invalidates its cached results
+    modules = set(ENGINE_MODULES) | {sys.modules[effect.__module__] for effect, kwargs in chain}
+    return ' '.join(_file_digest(module.__file__) for module in sorted(modules, key=lambda module: module.__name__))
+
+
+class ResultCache:
+
+    def __init__(self, directory, max_size=CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+        # size estimate, measured by the first eviction and then counted on put
+        self.size = None
+
+    def key(self, image, chain):
+
+        chain = [(effect, kwargs) for effect, kwargs in chain if effect is not None]
+        if not chain or not effects.is_deterministic(chain):
+            return None
+
+        image = image.convertToFormat(QImage.Format_RGB32)
+
+        digest = hashlib.sha256()
+        digest.update(('%s %s %s\n' % (source_version(chain), image.width(), image.height())).encode())
+
+        for y in range(image.height()):
+            digest.update(image.constScanLine(y).asstring(image.width() * 4))
+
+        for name, kwargs in effects.chain_key(chain):
+            digest.update(('%s %s\n' % (name, kwargs)).encode())
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.' + CACHE_FORMAT.lower())
+
+    def get(self, key):
+
+        if key is None:
+            return None
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        image = QImage(path, CACHE_FORMAT)
+        if image.isNull():
+            return None
+
+        # touch file, modification time is the last access for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return image
+
+    def put(self, key, image):
+
+        if key is None:
+            return
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        if image.save(temp_path, CACHE_FORMAT, CACHE_QUALITY):
+            os.replace(temp_path, path)
+
+            if self.size is not None:
+                self.size += os.path.getsize(path)
+            if self.size is None or self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.tmp'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(file_size for mtime, file_size, path in files)
+
+        # least recently used first
+        if size > self.max_size:
+            for mtime, file_size, path in sorted(files):
+                if size <= self.max_size * EVICT_RATIO:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                size -= file_size
+
+        self.size = size
@@ -0,0 +1,192 @@
+import colorsys
+from operator import add
+
+
+# Rec.709 luma coefficients
+LUMA_R = 0.2126
+LUMA_G = 0.7152
+LUMA_B = 0.0722
+
+# D65 white point
+WHITE_X = 0.95047
+WHITE_Y = 1.0
+WHITE_Z = 1.08883
+
+LINEAR_STEPS = 4096
+
+
+def _decode(value):
+    value = value / 255
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def _encode(value):
+    if value <= 0.0031308:
+        value = value * 12.92
+    else:
+        value = 1.055 * value ** (1 / 2.4) - 0.055
+    return int(round(value * 255))
+
+
+# tables are computed once on import, every transform is a few lookups
+SRGB_TO_LINEAR = tuple(_decode(v) for v in range(256))
+LINEAR_TO_SRGB = tuple(_encode(i / (LINEAR_STEPS - 1)) for i in range(LINEAR_STEPS))
+
+LUMA_TABLE_R = tuple(LUMA_R * v for v in range(256))
+LUMA_TABLE_G = tuple(LUMA_G * v for v in range(256))
+LUMA_TABLE_B = tuple(LUMA_B * v for v in range(256))
+
+LUMINANCE_TABLE_R = tuple(LUMA_R * v for v in SRGB_TO_LINEAR)
+LUMINANCE_TABLE_G = tuple(LUMA_G * v for v in SRGB_TO_LINEAR)
+LUMINANCE_TABLE_B = tuple(LUMA_B * v for v in SRGB_TO_LINEAR)
+
+# luminance in fixed point: contributions of channels are integers, their sum indexes one encoding table
+LUMINANCE_STEPS = 4 * (LINEAR_STEPS - 1)
+
+LUMINANCE_FIXED_R = tuple(int(round(v * LUMINANCE_STEPS)) for v in LUMINANCE_TABLE_R)
+LUMINANCE_FIXED_G = tuple(int(round(v * LUMINANCE_STEPS)) for v in LUMINANCE_TABLE_G)
+LUMINANCE_FIXED_B = tuple(int(round(v * LUMINANCE_STEPS)) for v in LUMINANCE_TABLE_B)
+
+# rounded contributions of white may sum one step over
+LUMINANCE_TO_SRGB = bytes(_encode(min(1, i / LUMINANCE_STEPS)) for i in range(LUMINANCE_STEPS + 2))
+
+
+def channel(value):
+    value = int(value)
+    if value > 255:
+        return 255
+    elif value < 0:
+        return 0
+    return value
+
+
+def to_linear(r, g, b):
+    return SRGB_TO_LINEAR[channel(r)], SRGB_TO_LINEAR[channel(g)], SRGB_TO_LINEAR[channel(b)]
+
+
+def linear_to_srgb(value):
+    if value <= 0:
+        return 0
+    elif value >= 1:
+        return 255
+    return LINEAR_TO_SRGB[int(value * (LINEAR_STEPS - 1) + 0.5)]
+
+
+def from_linear(r, g, b):
+    return linear_to_srgb(r), linear_to_srgb(g), linear_to_srgb(b)
+
+
+def luma(r, g, b):
+    # Rec.709 luma of gamma encoded values, 0..255
+    return LUMA_TABLE_R[channel(r)] + LUMA_TABLE_G[channel(g)] + LUMA_TABLE_B[channel(b)]
+
+
+def luminance(r, g, b):
+    # relative luminance of linear values, 0..1
+    return LUMINANCE_TABLE_R[channel(r)] + LUMINANCE_TABLE_G[channel(g)] + LUMINANCE_TABLE_B[channel(b)]
+
+
+def luminance_grey(r, g, b):
+    # perceptual grey level 0..255: luminance encoded back to sRGB
+    return LUMINANCE_TO_SRGB[LUMINANCE_FIXED_R[channel(r)] + LUMINANCE_FIXED_G[channel(g)] + LUMINANCE_FIXED_B[channel(b)]]
+
+
+def luminance_grey_row(row):
+
+    # luminance_grey of every pixel of RGB32 row (bytes in order B, G, R, A), no python code runs per pixel
+    totals = map(add, map(add, map(LUMINANCE_FIXED_B.__getitem__, row[0::4]),
+                                  map(LUMINANCE_FIXED_G.__getitem__, row[1::4])),
+                      map(LUMINANCE_FIXED_R.__getitem__, row[2::4]))
+
+    return bytes(map(LUMINANCE_TO_SRGB.__getitem__, totals))
+
+
+def rgb_to_hsv(r, g, b):
+    return colorsys.rgb_to_hsv(channel(r) / 255, channel(g) / 255, channel(b) / 255)
+
+
+def hsv_to_rgb(h, s, v):
+    r, g, b = colorsys.hsv_to_rgb(h, s, v)
+    return channel(round(r * 255)), channel(round(g * 255)), channel(round(b * 255))
+
+
+def shift_hue_saturation(r, g, b, shift=0, scale=1):
+
+    # hsv hue is shifted by sixths of the circle and chroma scaled on the hexcone,
+    # value is kept: same as a round trip through hsv, without the conversions
+    r, g, b = channel(r), channel(g), channel(b)
+    v = max(r, g, b)
+    c = v - min(r, g, b)
+    if not c:
+        return r, g, b
+
+    if v == r:
+        h = (g - b) / c
+    elif v == g:
+        h = 2 + (b - r) / c
+    else:
+        h = 4 + (r - g) / c
+    h = (h + shift) % 6
+
+    c = c * scale
+    if c > v:
+        c = v
+
+    sector = int(h)
+    f = h - sector
+    p, q, t = round(v - c), round(v - c * f), round(v - c * (1 - f))
+
+    if sector == 0:
+        return v, t, p
+    elif sector == 1:
+        return q, v, p
+    elif sector == 2:
+        return p, v, t
+    elif sector == 3:
+        return p, q, v
+    elif sector == 4:
+        return t, p, v
+    return v, p, q
+
+
+def _lab_f(t):
+    if t > 216 / 24389:
+        return t ** (1 / 3)
+    return (24389 / 27 * t + 16) / 116
+
+
+def _lab_f_inverse(t):
+    if t ** 3 > 216 / 24389:
+        return t ** 3
+    return (116 * t - 16) / (24389 / 27)
+
+
+def rgb_to_lab(r, g, b):
+
+    r, g, b = to_linear(r, g, b)
+
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / WHITE_X
+    y = (0.2126 * r + 0.7152 * g + 0.0722 * b) / WHITE_Y
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / WHITE_Z
+
+    fx, fy, fz = _lab_f(x), _lab_f(y), _lab_f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def lab_to_rgb(l, a, b):
+
+    fy = (l + 16) / 116
+    fx = fy + a / 500
+    fz = fy - b / 200
+
+    x = _lab_f_inverse(fx) * WHITE_X
+    y = _lab_f_inverse(fy) * WHITE_Y
+    z = _lab_f_inverse(fz) * WHITE_Z
+
+    return from_linear(
+        3.2406 * x - 1.5372 * y - 0.4986 * z,
+        -0.9689 * x + 1.8758 * y + 0.0415 * z,
+        0.0557 * x - 0.2040 * y + 1.0570 * z,
+    )
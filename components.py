@@ -1,4 +1,4 @@
-from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtCore import QMetaObject, Qt, pyqtSlot
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtWidgets import QHBoxLayout, QLabel, QProgressBar, QPushButton, QSlider, QTabWidget, QVBoxLayout, QWidget
 
@@ -36,6 +36,36 @@ class BrightContrastWidget(QWidget):
         self.widgetContrast.reset()
 
 
+class HueSaturationWidget(QWidget):
+
+    def __init__(self, label_widget=None):
+
+        super(QWidget, self).__init__()
+
+        self.widgetHue = TitledSliderWidget("Hue", label_widget, TitledSliderWidget.slider_hue, '-180', '+180')
+        self.widgetSaturation = TitledSliderWidget("Saturation", label_widget, TitledSliderWidget.slider_saturation, 'x0.5', 'x2')
+
+        # sliders layout
+        self.layout = QVBoxLayout()
+        self.layout.setSpacing(0)
+        self.layout.setContentsMargins(5, 0, 5, 0)
+
+        self.layout.addStretch(1)
+        self.layout.addWidget(self.widgetHue)
+        self.layout.addStretch(1)
+        self.layout.addWidget(self.widgetSaturation)
+        self.layout.addStretch(1)
+
+        self.setLayout(self.layout)
+
+    def apply(self):
+        return self.widgetHue.apply(), self.widgetSaturation.apply()
+
+    def reset(self):
+        self.widgetHue.reset()
+        self.widgetSaturation.reset()
+
+
 class ProgressBar(QProgressBar):
 
     def __init__(self):
@@ -98,9 +128,11 @@ class SliderTabsWidget(QTabWidget):
         self.tabs = QTabWidget()
         self.tab_bc = BrightContrastWidget(self.imageLabel)
         self.tab_rgb = RGBWidget(self.imageLabel)
+        self.tab_hs = HueSaturationWidget(self.imageLabel)
 
         self.tabs.addTab(self.tab_bc, "Brightness / Contrast")
         self.tabs.addTab(self.tab_rgb, "RGB")
+        self.tabs.addTab(self.tab_hs, "Hue / Saturation")
         self.layout.addWidget(self.tabs)
 
         self.layout_buttons = QHBoxLayout()
@@ -129,24 +161,26 @@ class SliderTabsWidget(QTabWidget):
 
         self.main_window.updateActions(state=False)
 
-        filters = self.tab_bc.apply() + self.tab_rgb.apply()
+        filters = self.tab_bc.apply() + self.tab_rgb.apply() + self.tab_hs.apply()
         image = self.imageLabel.pixmap().toImage()
+        self.main_window.chain.extend(filters)
 
-        self.main_window.thread = effects.Threader(image, filters, progressbar=self.progressbar)
+        self.main_window.thread = effects.Threader(image, filters, progressbar=self.progressbar, cache=self.main_window.cache, client=self.main_window.client)
         self.main_window.thread.moveToThread(self.main_window.back_thread)
 
         self.main_window.thread.sig_done.connect(self.main_window.effected)
         self.main_window.thread.sig_done.connect(self.progressbar.done)
         self.main_window.thread.sig_step.connect(self.progressbar.set_value)
+        self.main_window.thread.sig_client_lost.connect(self.main_window.client_lost)
 
-        self.main_window.back_thread.started.connect(self.main_window.thread.run)
-        self.main_window.back_thread.started.emit()
+        QMetaObject.invokeMethod(self.main_window.thread, 'run', Qt.QueuedConnection)
 
         self.reset()
 
     def reset(self):
         self.tab_bc.reset()
         self.tab_rgb.reset()
+        self.tab_hs.reset()
 
 
 class TitledSliderWidget(QWidget):
@@ -239,10 +273,26 @@ class TitledSliderWidget(QWidget):
             return effects.green, {'factor': green}
         return None, None
 
+    def slider_hue(self):
+
+        hue = (self.slider.value() - 50) * 3.6 - self.old_value
+        if hue != 0:
+            self.old_value += hue
+            return effects.hue_saturation, {'hue': hue}
+        return None, None
+
     def slider_red(self):
 
         red = self.slider.value() - 50 - self.old_value
         if red != 0:
             self.old_value += red
             return effects.red, {'factor': red}
+        return None, None
+
+    def slider_saturation(self):
+
+        saturation = (self.slider.value() - 50) * 2 - self.old_value
+        if saturation != 0:
+            self.old_value += saturation
+            return effects.hue_saturation, {'saturation': saturation}
         return None, None
\ No newline at end of file
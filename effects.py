@@ -1,9 +1,15 @@
-from PyQt5.QtCore import QObject, QPoint, QThread, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QColor, QImage
 
 import math
 import random
+from array import array
 from functools import wraps
+from operator import add
+
+import colorspace
+import labeling
+import registry
 
 
 COLOR_MATRIX = {
@@ -20,12 +26,102 @@ COLOR_MATRIX = {
 }
 
 
+# === kernels, declared by effects in the registry ===
+
+def _clamp(color):
+    color = int(color)
+    if color > 255:
+        return 255
+    elif color < 0:
+        return 0
+    return color
+
+
+def compile_sum_tables(chain):
+
+    tables = [], [], []
+    for total in range(256 * 3 - 2):
+        r, g, b = total - 2 * (total // 3), total // 3, total // 3
+        for effect, kwargs in chain:
+            r, g, b = effect(r, g, b, **kwargs)
+        tables[0].append(_clamp(b))
+        tables[1].append(_clamp(g))
+        tables[2].append(_clamp(r))
+
+    return tuple(bytes(table) for table in tables)
+
+
+def compile_tables(chain):
+
+    # every channel depends only on itself, so gray levels give the whole table
+    tables = [], [], []
+    for v in range(256):
+        r, g, b = v, v, v
+        for effect, kwargs in chain:
+            r, g, b = effect(r, g, b, **kwargs)
+        tables[0].append(_clamp(b))
+        tables[1].append(_clamp(g))
+        tables[2].append(_clamp(r))
+
+    return tuple(bytes(table) for table in tables)
+
+
+def lut_kernel(chain):
+
+    # vectorized kernel of channel effects: rows are translated channel by channel
+    if not is_lut(chain):
+        return None
+
+    tables = compile_tables(chain)
+
+    def _row(row):
+        for channel, table in enumerate(tables):
+            row[channel::4] = row[channel::4].translate(table)
+
+    return _row
+
+
+def luminance_kernel(chain):
+
+    # vectorized kernel of perceptual grey: grey levels of the row come from colorspace tables,
+    # the rest of the chain sees only 256 grey levels
+    if not is_deterministic(chain):
+        return None
+
+    tables = compile_tables(chain[1:])
+
+    def _row(row):
+        grey = colorspace.luminance_grey_row(row)
+        for channel, table in enumerate(tables):
+            row[channel::4] = grey.translate(table)
+
+    return _row
+
+
+def sum_kernel(chain):
+
+    # vectorized kernel of effects of r+g+b: first effect sees only the sum, so the whole chain does
+    if not is_deterministic(chain):
+        return None
+
+    tables = compile_sum_tables(chain)
+
+    def _row(row):
+        sums = list(map(add, map(add, row[0::4], row[1::4]), row[2::4]))
+        for channel, table in enumerate(tables):
+            row[channel::4] = bytes(map(table.__getitem__, sums))
+
+    return _row
+
+
+@registry.register('Black and white image', registry.SUM, menu='Black & White', group=1, order=2, vectorized=sum_kernel)
 def black_white(r, g, b):
     if (r + g + b)/3 > 128:
         return 255, 255, 255
     return 0, 0, 0
 
 
+@registry.register('Blue chanel', registry.LUT, vectorized=lut_kernel)
 def blue(r, g, b, factor=0):
     b = b + factor
     if b > 255:
@@ -35,11 +131,13 @@ def blue(r, g, b, factor=0):
     return r, g, b
 
 
+@registry.register('Blue and yellow image', menu='Blue & Yellow', group=1, order=4)
 def blue_yellow(r, g, b):
     m = (r+g)/2
     return m, m, b
 
 
+@registry.register('Brightness', registry.LUT, vectorized=lut_kernel)
 def brightness(r, g, b, factor=0):
 
     rgb = [r, g, b]
@@ -56,6 +154,7 @@ def brightness(r, g, b, factor=0):
     return rgb
 
 
+@registry.register('Fake color', registry.SUM, vectorized=sum_kernel)
 def colorize(r, g, b, color_matrix=COLOR_MATRIX):
 
     m = (r+g+b)/3
@@ -68,6 +167,7 @@ def colorize(r, g, b, color_matrix=COLOR_MATRIX):
     return rgb
 
 
+@registry.register('Contrast', registry.LUT, vectorized=lut_kernel)
 def contrast(r, g, b, factor=0):
 
     factor = (259 * (factor + 255)) / (255 * (259 - factor));
@@ -86,71 +186,126 @@ def contrast(r, g, b, factor=0):
     return rgb
 
 
+@registry.register('Fake color (floodfill)', registry.GLOBAL, menu='Colorize', order=2, deterministic=False)
 def floodfill(image, color_matrix=COLOR_MATRIX, signal=None):
 
-    def _same_color(rgb_a, rgb_b, sensitive):
-        m_a = sum(rgb_a[:3])
-        m_b = sum(rgb_b[:3])
-        return abs(m_a - m_b) < sensitive/2
+    def _sum_rgb(pixel):
+        return (pixel >> 16 & 0xff) + (pixel >> 8 & 0xff) + (pixel & 0xff)
 
     color_step = int(math.ceil(255*3 / (len(color_matrix) - 1)))
+    sensitive = color_step / 2
+
+    image = image.convertToFormat(QImage.Format_RGB32)
+    width, height = image.width(), image.height()
+
+    # labels of pixels in row-major order, 0 is not filled yet; built by repetition, without a temporary copy
+    pixel_labels = array('I', [0]) * (width * height)
 
-    # map of pixels
-    pixel_bitmap = [[None] * image.height() for i in range(image.width())]
+    # color of every filled component, label n has color component_colors[n-1]
+    component_colors = array('I')
+    floodfill_list = array('I')
 
     # floodfilling
-    for i in range(image.width()):
+    for y in range(height):
 
         if signal:
-            signal.emit(i)
+            signal.emit(y * width // height)
 
-        if i % 100 == 0:
-            print('line: %s/%s' % (i, image.width()))
+        if y % 100 == 0:
+            print('line: %s/%s' % (y, height))
 
-        for j in range(image.height()):
+        for x in range(width):
 
-            if pixel_bitmap[i][j]:
+            if pixel_labels[y * width + x]:
                 continue
 
-            floodfill_list = [(i, j)]
-            floodfill_color = QColor(image.pixel(i, j)).getRgb()
+            floodfill_color = _sum_rgb(image.pixel(x, y))
 
-            r, g, b = COLOR_MATRIX[random.randint(0, len(COLOR_MATRIX)-1)]
-            floodfill_by_color = QColor(r, g, b).rgb()
+            r, g, b = color_matrix[random.randint(0, len(color_matrix)-1)]
+            component_colors.append(QColor(r, g, b).rgb())
+            label = len(component_colors)
+
+            # membership depends only on the pixel and the seed, so pixels are labeled when pushed
+            # and every pixel is pushed at most once
+            pixel_labels[y * width + x] = label
+            floodfill_list.append(y * width + x)
 
             while floodfill_list:
 
-                _x, _y = floodfill_list.pop()
+                index = floodfill_list.pop()
+                _y, _x = divmod(index, width)
 
-                my_color = QColor(image.pixel(_x, _y)).getRgb()
-                same_color = _same_color(floodfill_color, my_color, color_step)
+                if _x > 0 and not pixel_labels[index - 1] \
+                        and abs(_sum_rgb(image.pixel(_x - 1, _y)) - floodfill_color) < sensitive:
+                    pixel_labels[index - 1] = label
+                    floodfill_list.append(index - 1)
 
-                if pixel_bitmap[_x][_y] or not same_color:
-                    continue
+                if _x < width - 1 and not pixel_labels[index + 1] \
+                        and abs(_sum_rgb(image.pixel(_x + 1, _y)) - floodfill_color) < sensitive:
+                    pixel_labels[index + 1] = label
+                    floodfill_list.append(index + 1)
 
-                pixel_bitmap[_x][_y] = floodfill_by_color
+                if _y > 0 and not pixel_labels[index - width] \
+                        and abs(_sum_rgb(image.pixel(_x, _y - 1)) - floodfill_color) < sensitive:
+                    pixel_labels[index - width] = label
+                    floodfill_list.append(index - width)
 
-                if _x > 0 and pixel_bitmap[_x - 1][_y] is None:
-                    floodfill_list.append((_x - 1, _y))
+                if _y < height - 1 and not pixel_labels[index + width] \
+                        and abs(_sum_rgb(image.pixel(_x, _y + 1)) - floodfill_color) < sensitive:
+                    pixel_labels[index + width] = label
+                    floodfill_list.append(index + width)
 
-                if _x < image.width()-1 and pixel_bitmap[_x+1][_y] is None:
-                    floodfill_list.append((_x+1, _y))
+    # every pixel is filled at least by itself, so colors are looked up row by row
+    for y in range(height):
 
-                if _y > 0 and pixel_bitmap[_x][_y - 1] is None:
-                    floodfill_list.append((_x, _y - 1))
+        if y % 100 == 0:
+            print('apply color: %s/%s' % (y, height))
 
-                if _y < image.height()-1 and pixel_bitmap[_x][_y + 1] is None:
-                    floodfill_list.append((_x, _y + 1))
+        row = array('I', (component_colors[label - 1] for label in pixel_labels[y * width:(y + 1) * width]))
 
-    for i in range(image.width()):
-        print('apply color: %s/%s' % (i, image.width()))
-        for j in range(image.height()):
-            if pixel_bitmap[i][j]:
-                image.setPixel(QPoint(i, j), pixel_bitmap[i][j])
+        line = image.scanLine(y)
+        line.setsize(image.bytesPerLine())
+        line[:width * 4] = row.tobytes()
 
     return image
 
 
+def floodfill_tiles(image, color_matrix=COLOR_MATRIX, signal=None, tile_size=labeling.TILE_SIZE, workers=None):
+
+    # tiled kernel of floodfill_tiled: tiles are labeled on a pool of workers
+    image = image.convertToFormat(QImage.Format_RGB32)
+    width, height = image.width(), image.height()
+
+    def _read_tile(tile):
+        x0, y0, w, h = tile
+        return b''.join(
+            image.constScanLine(y).asstring(image.bytesPerLine())[x0*4:(x0+w)*4] for y in range(y0, y0+h)
+        )
+
+    def _step(done):
+        if signal:
+            signal.emit(int(done * (width - 1)))
+
+    tiles = labeling.label_tiles(_read_tile, width, height, color_matrix,
+                                 tile_size=tile_size, workers=workers, step=_step)
+
+    for (x0, y0, w, h), data in tiles:
+        for y in range(h):
+            line = image.scanLine(y0 + y)
+            line.setsize(image.bytesPerLine())
+            line[x0*4:(x0+w)*4] = data[y*w*4:(y+1)*w*4]
+
+    return image
+
+
+@registry.register('Fake color (tiled floodfill)', registry.GLOBAL, menu='Colorize (tiled)', order=3,
+                   tiled=floodfill_tiles)
+def floodfill_tiled(image, color_matrix=COLOR_MATRIX, signal=None):
+    # same labeling tile after tile in this process, tiled kernel gives the same image
+    return floodfill_tiles(image, color_matrix, signal, workers=0)
+
+
+@registry.register('Green chanel', registry.LUT, vectorized=lut_kernel)
 def green(r, g, b, factor=0):
     g = g + factor
     if g > 255:
@@ -160,14 +315,29 @@ def green(r, g, b, factor=0):
     return r, g, b
 
 
+@registry.register('Greys', registry.SUM, menu='Greys', order=0, vectorized=sum_kernel)
 def grey(r, g, b):
     return [(r+g+b)/3] * 3
 
 
+@registry.register('Greys (perceptual)', menu='Greys (perceptual)', order=1, vectorized=luminance_kernel)
+def grey_perceptual(r, g, b):
+    return [colorspace.luminance_grey(r, g, b)] * 3
+
+
+@registry.register('Hue / Saturation')
+def hue_saturation(r, g, b, hue=0, saturation=0):
+
+    # saturation is in log scale: +100 doubles, -100 halves, so opposite changes cancel
+    return colorspace.shift_hue_saturation(r, g, b, hue/60, 2 ** (saturation/100))
+
+
+@registry.register('Invert colors', registry.LUT, menu='Invert', group=1, order=1, vectorized=lut_kernel)
 def invert(r, g, b):
     return 255-r, 255-g, 255-b
 
 
+@registry.register('Noize', menu='Noise', group=1, order=3, deterministic=False)
 def noise(r, g, b, ratio=0.5):
 
     rgb = [r, g, b]
@@ -186,6 +356,7 @@ def noise(r, g, b, ratio=0.5):
     return rgb
 
 
+@registry.register('Red chanel', registry.LUT, vectorized=lut_kernel)
 def red(r, g, b, factor=0):
     r = r + factor
     if r > 255:
@@ -195,6 +366,7 @@ def red(r, g, b, factor=0):
     return r, g, b
 
 
+@registry.register('Sepia', registry.SUM, menu='Sepia', group=1, order=0, vectorized=sum_kernel)
 def sepia(r, g, b, depth=25):
 
     m = (r+g+b)/3
@@ -211,70 +383,233 @@ def sepia(r, g, b, depth=25):
     return colors
 
 
+# images smaller than this are not worth starting a pool for tiled kernels
+TILED_PIXELS = 4 * 1024 * 1024
+
+# bounds of pixel lookup tables: entries of one table and tables kept per process
+LUT_SIZE = 1 << 16
+LUT_CHAINS = 4
+
+
+def chain_key(chain):
+    return tuple((effect.__name__, repr(sorted((kwargs or {}).items()))) for effect, kwargs in chain if effect is not None)
+
+
+def is_deterministic(chain):
+    return all(registry.get(effect) and registry.get(effect).deterministic for effect, kwargs in chain if effect is not None)
+
+
+def is_point(effect):
+    # unknown effects are applied pixel by pixel as before registry
+    spec = registry.get(effect)
+    return spec is None or spec.is_point
+
+
+def is_lut(chain):
+    return all(registry.get(effect) and registry.get(effect).category == registry.LUT for effect, kwargs in chain)
+
+
+def chain_lut(luts, chain):
+
+    key = chain_key(chain)
+    if key not in luts:
+        if len(luts) >= LUT_CHAINS:
+            luts.clear()
+        luts[key] = {}
+
+    return luts[key]
+
+
+def apply_chain_buffer(buffer, width, height, bytes_per_line, chain, lut=None, signal=None):
+
+    # buffer is writable RGB32 memory (bytes in order B, G, R, A)
+    chain = [(effect, kwargs or {}) for effect, kwargs in chain if effect is not None]
+    if not chain:
+        return buffer
+
+    row_size = width * 4
+
+    def _step(y):
+        if signal:
+            signal.emit(y * width // height)
+
+    # vectorized kernel of the first effect compiles the whole chain, rows are processed without python per pixel
+    spec = registry.get(chain[0][0])
+    kernel = spec.vectorized(chain) if spec and spec.vectorized else None
+
+    if kernel:
+        for y in range(height):
+            start = y * bytes_per_line
+            row = bytearray(buffer[start:start + row_size])
+            kernel(row)
+            buffer[start:start + row_size] = row
+            _step(y)
+        return buffer
+
+    # lookup table pixel -> pixel, filled on the fly and shared between frames
+    if not is_deterministic(chain):
+        lut = None
+    elif lut is None:
+        lut = {}
+
+    def _apply(pixel):
+        r, g, b = pixel >> 16 & 0xff, pixel >> 8 & 0xff, pixel & 0xff
+        for effect, kwargs in chain:
+            r, g, b = effect(r, g, b, **kwargs)
+        return pixel & 0xff000000 | _clamp(r) << 16 | _clamp(g) << 8 | _clamp(b)
+
+    for y in range(height):
+        start = y * bytes_per_line
+        pixels = array('I', bytes(buffer[start:start + row_size]))
+
+        if lut is None:
+            new_pixels = array('I', map(_apply, pixels))
+
+        else:
+            if len(lut) > LUT_SIZE:
+                lut.clear()
+
+            new_pixels = list(map(lut.get, pixels))
+            if None in new_pixels:
+                for i, pixel in enumerate(pixels):
+                    if new_pixels[i] is None:
+                        new_pixel = lut.get(pixel)
+                        if new_pixel is None:
+                            new_pixel = lut[pixel] = _apply(pixel)
+                        new_pixels[i] = new_pixel
+            new_pixels = array('I', new_pixels)
+
+        buffer[start:start + row_size] = new_pixels.tobytes()
+        _step(y)
+
+    return buffer
+
+
+def fuse(chain):
+
+    # point effects in a row are fused into one pass over the pixels
+    segments = []
+    for effect, kwargs in chain:
+        if effect is None:
+            continue
+
+        if segments and is_point(effect) and is_point(segments[-1][0][0]):
+            segments[-1].append((effect, kwargs))
+        else:
+            segments.append([(effect, kwargs)])
+
+    return segments
+
+
+def apply_segment(image, segment, luts=None, signal=None, workers=None):
+
+    if luts is None:
+        luts = {}
+
+    image = image.convertToFormat(QImage.Format_RGB32)
+    effect, kwargs = segment[0]
+
+    if is_point(effect):
+        width, height, bytes_per_line = image.width(), image.height(), image.bytesPerLine()
+        data = bytearray(image.constBits().asstring(image.byteCount()))
+        apply_chain_buffer(data, width, height, bytes_per_line, segment, lut=chain_lut(luts, segment), signal=signal)
+
+        return QImage(bytes(data), width, height, bytes_per_line, QImage.Format_RGB32).copy()
+
+    kwargs = kwargs or {}
+    spec = registry.get(effect)
+
+    # tiled kernel runs on a pool, small images are processed in place: pool start costs more than it gives
+    if spec and spec.tiled and workers != 0 and image.width() * image.height() >= TILED_PIXELS:
+        return spec.tiled(image, signal=signal, workers=workers, **kwargs).convertToFormat(QImage.Format_RGB32)
+
+    return effect(image, signal=signal, **kwargs).convertToFormat(QImage.Format_RGB32)
+
+
+def apply_chain(image, chain, luts=None, signal=None, workers=None):
+
+    if luts is None:
+        luts = {}
+
+    image = image.convertToFormat(QImage.Format_RGB32)
+    for segment in fuse(chain):
+        image = apply_segment(image, segment, luts=luts, signal=signal, workers=workers)
+
+    return image
+
+
 class Threader(QObject):
 
-    hack_title = {
-        black_white.__name__: 'Black and white image: %p%',
-        blue.__name__: 'Blue chanel: %p%',
-        blue_yellow.__name__: 'Blue and yellow image: %p%',
-        brightness.__name__: 'Brightness: %p%',
-        colorize.__name__: 'Fake color: %p%',
-        contrast.__name__: 'Contrast: %p%',
-        floodfill.__name__: 'Fake color (floodfill): %p%',
-        green.__name__: 'Green chanel: %p%',
-        grey.__name__: 'Greys: %p%',
-        invert.__name__: 'Invert colors: %p%',
-        noise.__name__: 'Noize: %p%',
-        red.__name__: 'Red chanel: %p%',
-        sepia.__name__:  'Sepia: %p%',
-    }
+    hack_title = {effect.name: '%s: %%p%%' % effect.title for effect in registry.EFFECTS.values()}
 
     sig_done = pyqtSignal(QImage)
     sig_step = pyqtSignal(int)
+    sig_client_lost = pyqtSignal()
 
-    def __init__(self, image, effect, progressbar=None, **kwargs):
+    def __init__(self, image, effect, progressbar=None, cache=None, client=None, **kwargs):
         super().__init__()
         self.image = image
         self.effect = effect
         self.kwargs = kwargs
+        self.cache = cache
+        self.client = client
 
+        self.progressbar = progressbar
         if progressbar:
-            self.progressbar = progressbar
             self.progressbar.setRange(0, self.image.width())
 
     @pyqtSlot()
     def run(self):
-        self.apply_effects()
-        self.sig_done.emit(self.image)
 
-    def apply_effect(self, effect, kwargs):
-
-        if self.progressbar:
-            self.progressbar.setFormat(self.hack_title.get(effect.__name__, '%p%'))
+        key = self.cache.key(self.image, self.chain()) if self.cache else None
+        image = self.cache.get(key) if self.cache else None
 
-        if effect.__name__ != floodfill.__name__:
-            for i in range(self.image.width()):
-                for j in range(self.image.height()):
-                    pixel = self.image.pixel(i, j)
-                    r, g, b, a = QColor(pixel).getRgb()
-                    r, g, b = effect(r, g, b, **kwargs)
-                    new_pixel = QColor(r, g, b)
-                    self.image.setPixel(QPoint(i, j), new_pixel.rgb())
+        if image is not None:
+            self.image = image
+        else:
+            if not (self.client and self.apply_remote()):
+                self.apply_effects()
+            if self.cache:
+                self.cache.put(key, self.image)
 
-                # if self.progressbar:
-                #     self.progressbar.setValue(i)
+        self.sig_done.emit(self.image)
 
-                self.sig_step.emit(i)
-                if (i+1) % 100 == 0 or i+1 == self.image.width():
-                    print('line: %s/%s' % (i+1, self.image.width()))
+    def apply_remote(self):
 
-        else:
-            self.image = floodfill(self.image, signal=self.sig_step)
+        if self.progressbar:
+            self.progressbar.setFormat('Effect server: %p%')
+
+        # effects are applied here when the job fails, server keeps serving the next ones
+        try:
+            self.image = self.client.apply(self.image, self.chain())
+        except RuntimeError as e:
+            print('effect server: %s' % e)
+            return False
+
+        # server is gone: connection is dropped
+        except (OSError, EOFError) as e:
+            print('effect server: %s' % e)
+            try:
+                self.client.close()
+            except OSError:
+                pass
+            self.client = None
+            self.sig_client_lost.emit()
+            return False
+
+        self.sig_step.emit(self.image.width())
+        return True
+
+    def chain(self):
+        if isinstance(self.effect, (list, tuple)):
+            return list(self.effect)
+        return [(self.effect, self.kwargs)]
 
     def apply_effects(self):
-        if isinstance(self.effect, (list, tuple)):
-            for effect, kwargs in self.effect:
-                if effect is not None:
-                    self.apply_effect(effect, kwargs)
-        else:
-            self.apply_effect(self.effect, self.kwargs)
\ No newline at end of file
+        for segment in fuse(self.chain()):
+
+            if self.progressbar:
+                title = self.hack_title.get(segment[0][0].__name__, '%p%') if len(segment) == 1 else 'Effects: %p%'
+                self.progressbar.setFormat(title)
+
+            self.image = apply_segment(self.image, segment, signal=self.sig_step)
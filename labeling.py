@@ -0,0 +1,192 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import math
+import multiprocessing
+import os
+
+
+TILE_SIZE = 512
+
+
+def color_table(color_matrix):
+    return [0xff000000 | r << 16 | g << 8 | b for r, g, b in (color_matrix[i] for i in range(len(color_matrix)))]
+
+
+def color_of(first, colors):
+    # component color depends only on its first pixel, so it does not depend on tiling
+    return colors[((first * 2654435761) & 0xffffffff) % len(colors)]
+
+
+def threshold(color_matrix):
+    return int(math.ceil(255*3 / (len(color_matrix) - 1))) / 2
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE):
+    return [
+        (x0, y0, min(tile_size, width - x0), min(tile_size, height - y0))
+        for y0 in range(0, height, tile_size)
+        for x0 in range(0, width, tile_size)
+    ]
+
+
+def _label(data, tile, image_width, sensitive):
+
+    # data is RGB32 rows of the tile (bytes in order B, G, R, A)
+    x0, y0, width, height = tile
+    size = width * height
+
+    sums = array('H', (data[i] + data[i+1] + data[i+2] for i in range(0, size * 4, 4)))
+    labels = array('I', bytes(4 * size))
+    firsts = array('Q')
+    stack = array('I')
+
+    for index in range(size):
+
+        if labels[index]:
+            continue
+
+        firsts.append((y0 + index // width) * image_width + x0 + index % width)
+        label = len(firsts)
+        labels[index] = label
+        stack.append(index)
+
+        while stack:
+
+            current = stack.pop()
+            color = sums[current]
+            x = current % width
+
+            for neighbor in (current - 1 if x > 0 else -1, current + 1 if x < width - 1 else -1,
+                             current - width, current + width):
+                if 0 <= neighbor < size and not labels[neighbor] and abs(sums[neighbor] - color) < sensitive:
+                    labels[neighbor] = label
+                    stack.append(neighbor)
+
+    return labels, firsts, sums
+
+
+def label_tile(data, tile, image_width, sensitive):
+
+    # only seams leave the worker: labels and colors of border pixels
+    width, height = tile[2], tile[3]
+    size = width * height
+    labels, firsts, sums = _label(data, tile, image_width, sensitive)
+
+    edges = tuple(
+        (labels[edge], sums[edge])
+        for edge in (slice(0, width), slice(size - width, size), slice(0, size, width), slice(width - 1, size, width))
+    )
+    border_firsts = {label: firsts[label - 1] for edge_labels, edge_sums in edges for label in edge_labels}
+
+    return edges, border_firsts
+
+
+def recolor_tile(data, tile, image_width, sensitive, colors, border_colors):
+
+    # labeling is deterministic, so the tile is labeled again instead of keeping labels
+    labels, firsts, sums = _label(data, tile, image_width, sensitive)
+
+    table = array('I', (border_colors.get(label) or color_of(first, colors) for label, first in enumerate(firsts, 1)))
+    return array('I', (table[label - 1] for label in labels)).tobytes()
+
+
+def _find(parent, label):
+    while parent[label] != label:
+        parent[label] = parent[parent[label]]
+        label = parent[label]
+    return label
+
+
+def _union(parent, firsts, a, b):
+    a, b = _find(parent, a), _find(parent, b)
+    if a == b:
+        return
+    if firsts[a] < firsts[b]:
+        parent[b] = a
+    else:
+        parent[a] = b
+
+
+def _ordered_map(pool, function, arguments, limit):
+
+    # keeps at most limit jobs in flight, results come in submit order
+    if pool is None:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    pending = deque()
+    for args in arguments:
+        pending.append(pool.submit(function, *args))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def label_tiles(read_tile, width, height, color_matrix, tile_size=TILE_SIZE, workers=None, step=None):
+
+    tiles = tile_grid(width, height, tile_size)
+    sensitive = threshold(color_matrix)
+    colors = color_table(color_matrix)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # workers are spawned, labeling runs in a thread of the qt application which is not safe to fork
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) if workers else None
+
+    try:
+        # labeling tiles, only components on tile borders get global ids
+        seams = []
+        parent = array('I')
+        firsts = array('Q')
+
+        arguments = ((read_tile(tile), tile, width, sensitive) for tile in tiles)
+        for i, (edges, border_firsts) in enumerate(_ordered_map(pool, label_tile, arguments, workers * 2)):
+            ids = {}
+            for label, first in sorted(border_firsts.items()):
+                ids[label] = len(parent)
+                parent.append(len(parent))
+                firsts.append(first)
+            seams.append((edges, ids))
+
+            if step:
+                step((i + 1) / len(tiles) / 2)
+
+        # merging labels along tile seams
+        columns = int(math.ceil(width / tile_size))
+
+        for i, (x0, y0, w, h) in enumerate(tiles):
+            (top, bottom, left, right), ids = seams[i]
+
+            if x0 + w < width:
+                other_edges, other_ids = seams[i + 1]
+                for label, color, other_label, other_color in zip(*right, *other_edges[2]):
+                    if abs(color - other_color) < sensitive:
+                        _union(parent, firsts, ids[label], other_ids[other_label])
+
+            if y0 + h < height:
+                other_edges, other_ids = seams[i + columns]
+                for label, color, other_label, other_color in zip(*bottom, *other_edges[0]):
+                    if abs(color - other_color) < sensitive:
+                        _union(parent, firsts, ids[label], other_ids[other_label])
+
+        # recoloring: tiles are read again, border components take color of their merged root
+        def _arguments():
+            for tile, (edges, ids) in zip(tiles, seams):
+                border_colors = {label: color_of(firsts[_find(parent, gid)], colors) for label, gid in ids.items()}
+                yield read_tile(tile), tile, width, sensitive, colors, border_colors
+
+        for i, data in enumerate(_ordered_map(pool, recolor_tile, _arguments(), workers * 2)):
+            yield tiles[i], data
+
+            if step:
+                step(0.5 + (i + 1) / len(tiles) / 2)
+
+    finally:
+        if pool:
+            pool.shutdown()
@@ -0,0 +1,163 @@
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage
+
+import multiprocessing
+import os
+import re
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import effects
+
+
+SEQUENCE_EXTENSIONS = ('.bmp', '.gif', '.jpg', '.jpeg', '.png', '.pbm', '.pgm', '.ppm', '.xbm', '.xpm')
+
+FRAME_NUMBER = re.compile(r'(\d+)\.\w+$')
+
+# lookup tables of the worker process, compiled once and reused for every frame
+_luts = {}
+
+# caches of the worker process, they keep size estimate between frames
+_caches = {}
+
+
+def read_sequence(folder):
+
+    frames = []
+    for name in os.listdir(folder):
+        match = FRAME_NUMBER.search(name)
+        if match and name.lower().endswith(SEQUENCE_EXTENSIONS):
+            frames.append((int(match.group(1)), name))
+
+    return [os.path.join(folder, name) for number, name in sorted(frames)]
+
+
+def process_frame(path, chain, cache=None):
+
+    image = QImage(path)
+    if image.isNull():
+        raise IOError('Cannot load %s.' % path)
+
+    if cache:
+        cache = _caches.setdefault(cache.directory, cache)
+
+    key = cache.key(image, chain) if cache else None
+    result = cache.get(key) if cache else None
+
+    if result is None:
+        # worker is already one of the pool, tiled effects run in place
+        result = effects.apply_chain(image, chain, luts=_luts, workers=0)
+        if cache:
+            cache.put(key, result)
+
+    image = result.convertToFormat(QImage.Format_RGB32)
+    return image.width(), image.height(), image.bytesPerLine(), image.constBits().asstring(image.byteCount())
+
+
+class FramePipeline(QObject):
+
+    sig_frame = pyqtSignal(QImage)
+    sig_step = pyqtSignal(int)
+    sig_done = pyqtSignal()
+    sig_error = pyqtSignal(str)
+
+    def __init__(self, frames, chain, output=None, workers=None, max_in_flight=None, fps=None, cache=None):
+        super().__init__()
+
+        # frames are written under their own names, they would replace the source
+        if output and any(os.path.samefile(output, folder) for folder in {os.path.dirname(path) for path in frames}):
+            raise ValueError('Cannot write frames to their own folder %s.' % output)
+
+        self.frames = frames
+        self.chain = [(effect, kwargs) for effect, kwargs in chain if effect is not None]
+        self.output = output
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.fps = fps
+        self.cache = cache
+
+    @pyqtSlot()
+    def run(self):
+        self.started_at = None
+        self.latency = 0
+
+        try:
+            # workers are spawned, forking the running qt application can deadlock
+            with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                pending = deque()
+
+                for index, path in enumerate(self.frames):
+                    # preview does not compute frames which would be ready too late
+                    if self.is_late(index, time.monotonic() + self.latency):
+                        future = None
+                    else:
+                        future = pool.submit(process_frame, path, self.chain, self.cache)
+                        future.add_done_callback(partial(self.frame_ready, time.monotonic()))
+                    pending.append((index, path, future))
+
+                    # backpressure: wait for the oldest frame before submitting more
+                    if len(pending) >= self.max_in_flight:
+                        self.write_frame(*pending.popleft())
+
+                while pending:
+                    self.write_frame(*pending.popleft())
+
+        except Exception as e:
+            self.sig_error.emit(str(e))
+
+        finally:
+            self.sig_done.emit()
+
+    def frame_ready(self, submitted_at, future):
+        # time from submit to result, queueing in the pool included
+        self.latency = time.monotonic() - submitted_at
+
+    def is_late(self, index, ready_at=None):
+        # preview frame is late when the next one is due before it is shown, written frames are never late
+        if not self.fps or self.output or self.started_at is None:
+            return False
+        return (ready_at or time.monotonic()) > self.started_at + (index + 1) / self.fps
+
+    def write_frame(self, index, path, future):
+
+        if future is None:
+            self.sig_step.emit(index)
+            return
+
+        # broken frame is reported and skipped, sequence goes on
+        try:
+            width, height, bytes_per_line, data = future.result()
+            image = QImage(data, width, height, bytes_per_line, QImage.Format_RGB32).copy()
+
+            if self.output:
+                filename = os.path.join(self.output, os.path.basename(path))
+                if not image.save(filename):
+                    raise IOError('Cannot save %s.' % filename)
+
+        except Exception as e:
+            self.sig_error.emit(str(e))
+            self.sig_step.emit(index)
+            return
+
+        if self.fps:
+            # clock starts with the first frame, pool start is not counted as delay
+            if self.started_at is None:
+                self.started_at = time.monotonic() - index / self.fps
+
+            # late frames are dropped, preview plays in sync instead of in slow motion
+            if self.is_late(index):
+                self.sig_step.emit(index)
+                return
+
+            # hold the frame until its time to keep preview at constant rate
+            delay = self.started_at + index / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.sig_frame.emit(image)
+        self.sig_step.emit(index)
+
+        if (index+1) % 100 == 0 or index+1 == len(self.frames):
+            print('frame: %s/%s' % (index+1, len(self.frames)))
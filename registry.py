@@ -0,0 +1,81 @@
+import inspect
+
+
+# pixel by pixel, output depends on all channels of the pixel
+POINT = 'point'
+
+# pixel by pixel, every channel depends only on itself: compiled into 256-entry tables
+LUT = 'lut'
+
+# pixel by pixel, output depends only on r+g+b: compiled into 766-entry table
+SUM = 'sum'
+
+# output pixel depends on pixels around it
+NEIGHBORHOOD = 'neighborhood'
+
+# output depends on the whole image
+GLOBAL = 'global'
+
+CATEGORIES = (POINT, LUT, SUM, NEIGHBORHOOD, GLOBAL)
+
+# kernels an effect may declare besides its function, the engine picks the fastest one which applies:
+# vectorized kernel(chain) compiles the chain which starts with the effect into a function of a whole
+# RGB32 row, or returns None when it cannot run the chain;
+# tiled kernel takes arguments of the effect plus number of workers and splits the image in tiles
+
+# arguments which are passed by the engine, not by user
+ENGINE_ARGUMENTS = ('r', 'g', 'b', 'image', 'signal', 'workers')
+
+EFFECTS = {}
+
+
+class Effect:
+
+    def __init__(self, function, title, category=POINT, menu=None, group=0, order=0, deterministic=True,
+                 vectorized=None, tiled=None):
+
+        if category not in CATEGORIES:
+            raise ValueError('Unknown category %s.' % category)
+
+        self.function = function
+        self.name = function.__name__
+        self.title = title
+        self.category = category
+
+        # menu title, effects without it are applied from sliders only
+        self.menu = menu
+        self.group = group
+        self.order = order
+
+        self.deterministic = deterministic
+
+        self.vectorized = vectorized
+        self.tiled = tiled
+
+        self.params = {
+            name: parameter.default
+            for name, parameter in inspect.signature(function).parameters.items()
+            if name not in ENGINE_ARGUMENTS and parameter.default is not inspect.Parameter.empty
+        }
+
+    @property
+    def is_point(self):
+        return self.category in (POINT, LUT, SUM)
+
+
+def register(title, category=POINT, **kwargs):
+
+    def decorator(function):
+        EFFECTS[function.__name__] = Effect(function, title, category, **kwargs)
+        return function
+
+    return decorator
+
+
+def get(effect):
+    name = effect if isinstance(effect, str) else effect.__name__
+    return EFFECTS.get(name)
+
+
+def menu():
+    return sorted((effect for effect in EFFECTS.values() if effect.menu), key=lambda effect: (effect.group, effect.order))
@@ -0,0 +1,382 @@
+from PyQt5.QtGui import QImage
+
+import getpass
+import json
+import math
+import multiprocessing
+import os
+import re
+import socket
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge, families
+
+import effects
+import registry
+
+
+# seconds to wait for the server greeting, something stuck on the address must not hang the viewer
+CONNECT_TIMEOUT = 2
+
+# jobs and replies are small json messages, pixels go through shared memory
+MESSAGE_SIZE = 64 * 1024
+
+SHARED_MEMORY_NAME = re.compile(r'^[\w.-]{1,128}$')
+
+# rows smaller than this are not worth a separate job
+BAND_HEIGHT = 64
+
+# lookup tables of the worker process, shared between all clients
+_luts = {}
+
+
+def runtime_directory():
+
+    # private directory of the user: socket and key are not reachable by others
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    directory = os.path.join(base, 'voover-%s' % getpass.getuser())
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    if os.name == 'posix':
+        status = os.lstat(directory)
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+            raise PermissionError('%s is not a private directory.' % directory)
+
+    return directory
+
+
+def server_address():
+    if 'AF_UNIX' in families:
+        return os.path.join(runtime_directory(), 'server.sock')
+    # named pipe, clients still need the key from the private directory
+    return r'\\.\pipe\voover-%s' % getpass.getuser()
+
+
+def _authkey_path():
+    return os.path.join(runtime_directory(), 'authkey')
+
+
+def new_authkey():
+
+    # every server start writes a new random key, readable by the owner only
+    authkey = os.urandom(32)
+    path = _authkey_path()
+    temp_path = '%s.%s.tmp' % (path, os.getpid())
+
+    with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as file:
+        file.write(authkey)
+    os.replace(temp_path, path)
+
+    return authkey
+
+
+def read_authkey():
+    with open(_authkey_path(), 'rb') as file:
+        return file.read()
+
+
+def _remove_stale(address):
+
+    # socket file of a crashed server is removed, running server is kept
+    if not os.path.exists(address):
+        return
+
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(address)
+        except ConnectionRefusedError:
+            os.unlink(address)
+            return
+
+    raise RuntimeError('Effect server is already running on %s.' % address)
+
+
+def read_job(data):
+
+    # jobs come from other processes: plain json of known shape, nothing is unpickled
+    try:
+        name, width, height, bytes_per_line, chain = json.loads(data.decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError('Malformed job.')
+
+    if not isinstance(name, str) or not SHARED_MEMORY_NAME.match(name):
+        raise ValueError('Bad shared memory name.')
+
+    if not all(type(value) is int and value > 0 for value in (width, height, bytes_per_line)) \
+            or bytes_per_line < width * 4:
+        raise ValueError('Bad image size.')
+
+    if not isinstance(chain, list) or not all(
+            isinstance(step, list) and len(step) == 2 and isinstance(step[0], str) and isinstance(step[1], dict)
+            for step in chain):
+        raise ValueError('Malformed chain.')
+
+    return name, width, height, bytes_per_line, [tuple(step) for step in chain]
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+
+    # before python 3.13 attaching registers the segment, which belongs to client
+    memory = shared_memory.SharedMemory(name)
+    resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def resolve_chain(chain):
+
+    resolved = []
+    for name, kwargs in chain:
+        effect = registry.get(name)
+        if effect is None:
+            raise ValueError('Unknown effect %s.' % name)
+
+        unknown = set(kwargs) - set(effect.params)
+        if unknown:
+            raise ValueError('Unknown parameters of %s: %s.' % (name, ', '.join(sorted(unknown))))
+
+        if not all(type(value) in (int, float) and math.isfinite(value) for value in kwargs.values()):
+            raise ValueError('Parameters of %s must be numbers.' % name)
+
+        resolved.append((effect.function, kwargs))
+
+    return resolved
+
+
+def run_band(name, width, bytes_per_line, chain, y0, y1):
+
+    chain = resolve_chain(chain)
+
+    memory = _attach(name)
+    try:
+        if memory.size < y1 * bytes_per_line:
+            raise ValueError('Image does not fit in shared memory.')
+
+        buffer = memory.buf[y0 * bytes_per_line:y1 * bytes_per_line]
+        try:
+            effects.apply_chain_buffer(buffer, width, y1 - y0, bytes_per_line, chain, lut=effects.chain_lut(_luts, chain))
+        finally:
+            buffer.release()
+    finally:
+        memory.close()
+
+
+def run_image(name, width, height, bytes_per_line, chain):
+
+    chain = resolve_chain(chain)
+    size = height * bytes_per_line
+
+    memory = _attach(name)
+    try:
+        if memory.size < size:
+            raise ValueError('Image does not fit in shared memory.')
+
+        image = QImage(bytes(memory.buf[:size]), width, height, bytes_per_line, QImage.Format_RGB32)
+        # worker is already one of the pool, tiled effects run in place
+        image = effects.apply_chain(image, chain, luts=_luts, workers=0)
+        memory.buf[:size] = image.constBits().asstring(size)
+    finally:
+        memory.close()
+
+
+class EffectServer:
+
+    def __init__(self, address=None, workers=None):
+        self.address = address or server_address()
+        self.workers = workers or os.cpu_count() or 1
+        self.authkey = None
+
+    def serve_forever(self):
+
+        if 'AF_UNIX' in families:
+            _remove_stale(self.address)
+
+        # one pool for all clients, their jobs are queued and spread over all cores;
+        # workers are spawned, forking the threaded server is not safe
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+        with Listener(self.address) as listener:
+            # key is written only when the address is ours
+            self.authkey = new_authkey()
+            print('effect server: %s, workers: %s' % (listener.address, self.workers))
+
+            while True:
+                try:
+                    connection = listener.accept()
+                except OSError:
+                    continue
+
+                threading.Thread(target=self.serve_client, args=(connection,), daemon=True).start()
+
+    def serve_client(self, connection):
+
+        with connection:
+            try:
+                # handshake runs here, a silent client blocks only its own thread
+                deliver_challenge(connection, self.authkey)
+                answer_challenge(connection, self.authkey)
+
+                while True:
+                    job = connection.recv_bytes(MESSAGE_SIZE)
+                    try:
+                        self.apply(*read_job(job))
+                        reply = ['done', None]
+                    except Exception as e:
+                        reply = ['error', str(e)]
+                    connection.send_bytes(json.dumps(reply).encode())
+
+            except (AuthenticationError, EOFError, OSError):
+                # client is gone, reset the connection or has not the key
+                return
+
+    def apply(self, name, width, height, bytes_per_line, chain):
+
+        resolved = resolve_chain(chain)
+
+        if not all(effects.is_point(effect) for effect, kwargs in resolved):
+            futures = [self.pool.submit(run_image, name, width, height, bytes_per_line, chain)]
+
+        else:
+            # point effects: image is split in bands of rows processed in parallel
+            band = max(BAND_HEIGHT, int(math.ceil(height / self.workers)))
+            futures = [
+                self.pool.submit(run_band, name, width, bytes_per_line, chain, y0, min(y0 + band, height))
+                for y0 in range(0, height, band)
+            ]
+
+        for future in futures:
+            future.result()
+
+
+class EffectClient:
+
+    def __init__(self, address=None, authkey=None, timeout=CONNECT_TIMEOUT):
+        authkey = authkey or read_authkey()
+
+        self.connection = Client(address or server_address())
+        try:
+            if not self.connection.poll(timeout):
+                raise TimeoutError('Effect server does not answer.')
+            answer_challenge(self.connection, authkey)
+            deliver_challenge(self.connection, authkey)
+        except Exception:
+            self.connection.close()
+            raise
+
+        self.memory = None
+
+    def apply(self, image, chain):
+
+        image = image.convertToFormat(QImage.Format_RGB32)
+        width, height, bytes_per_line = image.width(), image.height(), image.bytesPerLine()
+        size = height * bytes_per_line
+
+        # shared memory is kept between jobs while images fit in it
+        if self.memory is None or self.memory.size < size:
+            self.close_memory()
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+
+        self.memory.buf[:size] = image.constBits().asstring(size)
+
+        chain = [(effect.__name__, kwargs or {}) for effect, kwargs in chain if effect is not None]
+        try:
+            job = json.dumps([self.memory.name, width, height, bytes_per_line, chain])
+        except (TypeError, ValueError) as e:
+            raise RuntimeError('Job cannot be sent to effect server: %s' % e)
+
+        self.connection.send_bytes(job.encode())
+
+        # reply is parsed as json too, whatever answers on the address cannot run code here
+        try:
+            status, message = json.loads(self.connection.recv_bytes(MESSAGE_SIZE).decode('utf-8'))
+        except (ValueError, TypeError):
+            raise ConnectionError('Malformed reply of effect server.')
+
+        if status != 'done':
+            raise RuntimeError(message)
+
+        return QImage(bytes(self.memory.buf[:size]), width, height, bytes_per_line, QImage.Format_RGB32).copy()
+
+    def close_memory(self):
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def close(self):
+        self.close_memory()
+        self.connection.close()
+
+
+def connect(address=None, authkey=None):
+    # no server, or something else on the address
+    try:
+        return EffectClient(address, authkey=authkey)
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+
+def benchmark(clients=1, jobs=10, width=1920, height=1080, chain=None, address=None):
+
+    if chain is None:
+        chain = [(effects.sepia, {}), (effects.brightness, {'factor': 10}), (effects.contrast, {'factor': 10})]
+
+    data = bytes(
+        channel
+        for y in range(height)
+        for x in range(width)
+        for channel in ((x + y) % 256, y % 256, x % 256, 255)
+    )
+    image = QImage(data, width, height, width * 4, QImage.Format_RGB32).copy()
+
+    errors = []
+
+    def _client():
+        client = EffectClient(address)
+        try:
+            for i in range(jobs):
+                client.apply(image, chain)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=_client) for i in range(clients)]
+
+    started_at = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started_at
+
+    if errors:
+        raise errors[0]
+
+    frames = clients * jobs
+    return frames / elapsed, frames * width * height / elapsed / 1e6
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Image Voover effect server')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, all cores by default')
+    parser.add_argument('--bench', type=int, default=0, metavar='CLIENTS',
+                        help='measure throughput of running server for CLIENTS concurrent clients')
+    parser.add_argument('--jobs', type=int, default=10, help='jobs of every client in benchmark')
+    args = parser.parse_args()
+
+    if args.bench:
+        jobs_per_second, megapixels_per_second = benchmark(clients=args.bench, jobs=args.jobs)
+        print('clients: %s, jobs/s: %.2f, Mpx/s: %.2f' % (args.bench, jobs_per_second, megapixels_per_second))
+    else:
+        EffectServer(workers=args.workers).serve_forever()